@@ -8,6 +8,7 @@ For reference, see:
 """
 
 import numpy
+import scipy.linalg
 
 
 class RiemannianUKF(object):
@@ -22,6 +23,14 @@ class RiemannianUKF(object):
     def __init__(self, statespace, unscented):
         self.statespace = statespace
         self.unscented = unscented
+        # Scratch buffers reused across predict/update calls so the hot path
+        # does not reallocate the sigma and observation banks every step.
+        # Shapes: M = 18 state parameters, 2M + 1 sigmas, 6 observation
+        # parameters.
+        self._scratch = {
+            "local_sigmas": numpy.empty((18, 37)),
+            "os": numpy.empty((6, 37)),
+        }
 
     def predict(self, x, P, Q, dt):
         """Perform the predict phase of the unscented Kalman filter.
@@ -36,9 +45,10 @@ class RiemannianUKF(object):
             x: The predicted state estimate.
             P: The predicted error covariance.
         """
-        return predict(x, P, Q, dt, self.statespace, self.unscented)
+        return predict(x, P, Q, dt, self.statespace, self.unscented,
+                       self._scratch)
 
-    def update(self, x, P, R, z):
+    def update(self, x, P, R, z, R_chol=None):
         """Perform the update phase of the unscented Kalman filter.
 
         Note that this makes the assumption that the `observation space` is a
@@ -49,25 +59,29 @@ class RiemannianUKF(object):
             P: The predicted error covariance, based at x.
             R: The observation covariance.
             z: The observation.
-        
+            R_chol: Optional precomputed Cholesky factor of R.
+
         Returns:
             x: The a-posteriori state estimate.
             P: The a-posteriori error covariance.
         """
-        return update(x, P, R, z, self.statespace, self.unscented)
+        return update(x, P, R, z, self.statespace, self.unscented,
+                      self._scratch, R_chol)
 
 
-def predict(x, P, Q, dt, statespace, unscented):
+def predict(x, P, Q, dt, statespace, unscented, scratch=None):
     """Perform the predict phase of the unscented Kalman filter.
-    
+
     Args:
         x: The a-priori state estimate.
         P: The a-priori error covariance, based at x.
-        Q: The transition covariance, based at x.
+        Q: The transition covariance, based at x. A diagonal Q may be
+           given as its 1-D diagonal, which takes a cheaper path.
         dt: The timestep.
         statespace: Knows how to manipulate states in local and global coords.
         unscented: Knows how to compute sigma points and covariances.
-    
+        scratch: Optional dict of preallocated buffers to write into.
+
     Returns:
         x: The predicted state estimate.
         P: The predicted error covariance.
@@ -75,18 +89,21 @@ def predict(x, P, Q, dt, statespace, unscented):
 
     xt = statespace.evolve_state(x, dt)
 
-    local_x = statespace.local_identity(x)
-    local_sigmas, w = unscented.sigmas_from_stats(local_x, P)
-    for i in range(local_sigmas.shape[1]):
-        g = statespace.local_to_global(x, local_sigmas[:, i])
-        g = statespace.evolve_state(g, dt)
-        local_sigmas[:, i] = statespace.global_to_local(xt, g)
+    sigma_buf = scratch["local_sigmas"] if scratch is not None else None
+    local_sigmas, w = unscented.sigmas_from_stats_zero(P, out=sigma_buf)
+    g = statespace.local_to_global_batch(x, local_sigmas)
+    g = statespace.evolve_state_batch(g, dt)
+    local_sigmas = statespace.global_to_local_batch(xt, g)
 
-    _, Pt = unscented.stats_from_sigmas(local_sigmas, w)
-    return xt, Pt + dt * statespace.local_transition_cov(xt, Q)
+    _, Pt, _ = unscented.stats_from_sigmas(local_sigmas, w)
+    if Q.ndim == 1:
+        cov = statespace.local_transition_cov_diag(xt, Q)
+    else:
+        cov = statespace.local_transition_cov(xt, Q)
+    return xt, Pt + dt * cov
 
 
-def update(x, P, R, z, statespace, unscented):
+def update(x, P, R, z, statespace, unscented, scratch=None, R_chol=None):
     """Perform the update phase of the unscented Kalman filter.
 
     Note that this makes the assumption that the `observation space` is a
@@ -99,39 +116,58 @@ def update(x, P, R, z, statespace, unscented):
         z: The observation.
         statespace: Knows how to manipulate states in local and global coords.
         unscented: Knows how to compute sigma points and covariances.
-    
+        scratch: Optional dict of preallocated buffers to write into.
+        R_chol: Optional precomputed Cholesky factor of R.
+
     Returns:
         x: The a-posteriori state estimate.
         P: The a-posteriori error covariance.
     """
 
-    local_x = statespace.local_identity(x)
-    local_sigmas, w = unscented.sigmas_from_stats(local_x, P)
-
-    os = numpy.zeros((6, local_sigmas.shape[1]))  # Should query from statespace
-    for i in range(local_sigmas.shape[1]):
-        g = statespace.local_to_global(x, local_sigmas[:, i])
-        os[:, i] = statespace.observe_state(g)
-
-    _, S = unscented.stats_from_sigmas(os, w)
-    S = S + R
-
-    C = local_sigmas @ (w * os).T
-    K = C @ numpy.linalg.inv(S)
-
-    new_local_x = K @ (z - statespace.observe_state(x))
+    sigma_buf = scratch["local_sigmas"] if scratch is not None else None
+    os_buf = scratch["os"] if scratch is not None else None
+    local_sigmas, w = unscented.sigmas_from_stats_zero(P, out=sigma_buf)
+
+    g = statespace.local_to_global_batch(x, local_sigmas)
+    os = statespace.observe_state_batch(g, out=os_buf)
+
+    # Square-root form of the innovation covariance: a QR decomposition of
+    # the weighted centered observation sigmas stacked with a Cholesky factor
+    # of R gives S_y with S_y @ S_y.T == cov(os) + R, without ever forming
+    # (or inverting) the full innovation covariance.
+    os_mean = os @ w
+    os_centered = os - os_mean[:, numpy.newaxis]
+    sqrt_R = numpy.linalg.cholesky(R) if R_chol is None else R_chol
+    w_sqrt = unscented.weights(P.shape[0])[1]
+    A = numpy.hstack((w_sqrt * os_centered, sqrt_R))
+    S_y = numpy.linalg.qr(A.T, mode="r").T
+
+    # The local sigmas have (exactly) zero weighted mean, so they are their
+    # own centered version; reuse the centered observations from above.
+    C = (local_sigmas * w) @ os_centered.T
+
+    # K = C @ inv(S) via two triangular solves against the factor. The
+    # intermediate of the first solve is exactly U = K @ S_y, which the
+    # covariance downdate needs, so keep it around.
+    Y = scipy.linalg.solve_triangular(S_y, C.T, lower=True)
+    U = Y.T
+    K = scipy.linalg.solve_triangular(S_y.T, Y, lower=False).T
+
+    # The predicted measurement is the weighted mean of the observation
+    # sigmas (already in hand), which is the standard UKF innovation and
+    # saves re-observing x.
+    new_local_x = K @ (z - os_mean)
     new_x = statespace.local_to_global(x, new_local_x)
 
-    new_P = P - K @ S @ K.T
+    # K @ S @ K.T == U @ U.T; subtracting a Gram matrix keeps the downdate
+    # symmetric and better conditioned.
+    new_P = P - U @ U.T
     new_P = 0.5 * (new_P + new_P.T)  # Symmetrize (a no-op in theory)
 
-    # rebase new_p
-    new_local_sigmas, w = unscented.sigmas_from_stats(local_x, new_P)
-    for i in range(new_local_sigmas.shape[1]):
-        g = statespace.local_to_global(x, new_local_sigmas[:, i])
-        new_local_sigmas[:, i] = statespace.global_to_local(new_x, g)
-
-    # get cov matrix at new_x
-    _, new_P = unscented.stats_from_sigmas(new_local_sigmas, w)
+    # rebase at new_x: the update steps the filter makes are small once it
+    # is tracking, so the frame change from x to new_x is, to first order,
+    # the block-diagonal parallel transport. Conjugating by it replaces the
+    # old regenerate-sigmas-and-recompute-covariance rebase outright.
+    new_P = statespace.transport_cov(x, new_local_x[9:12], new_P)
 
     return new_x, new_P
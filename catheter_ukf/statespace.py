@@ -14,8 +14,10 @@ q.
 Roll of the catheter is not represented.
 """
 
+import dataclasses
+
+import numba
 import numpy
-import quaternion
 
 
 class States(object):
@@ -45,6 +47,10 @@ class States(object):
         """ """
         return observe_state(s, self.coil_offset)
 
+    def observe_state_batch(self, S, out=None):
+        """ """
+        return observe_state_batch(S, self.coil_offset, out)
+
     def tip_from_state(self, s):
         """ """
         return tip_from_state(s, self.tip_offset)
@@ -57,71 +63,199 @@ class States(object):
         """ """
         return local_to_global(global_base, local_coordinate)
 
+    def evolve_state_batch(self, S, dt):
+        """ """
+        return evolve_state_batch(S, dt)
+
+    def global_to_local_batch(self, global_base, global_coordinates):
+        """ """
+        return global_to_local_batch(global_base, global_coordinates)
+
+    def local_to_global_batch(self, global_base, local_coordinates):
+        """ """
+        return local_to_global_batch(global_base, local_coordinates)
+
     def local_identity(self, global_base):
         """ """
         return numpy.zeros(18)
 
+    def transport_cov(self, global_base, v, P):
+        """ """
+        return transport_cov(global_base, v, P)
+
     def local_transition_cov(self, s, Q):
         """ """
         return local_transition_cov(s, Q)
 
+    def local_transition_cov_diag(self, s, Q_diag):
+        """ """
+        return local_transition_cov_diag(s, Q_diag)
 
-def Rot(base, v):
-    x = numpy.cross(base, v)
-    return quaternion.as_rotation_matrix(quaternion.from_rotation_vector(x))
 
+@numba.njit(cache=True, fastmath=True)
+def _cross3(a, b):
+    c = numpy.empty(3)
+    c[0] = a[1] * b[2] - a[2] * b[1]
+    c[1] = a[2] * b[0] - a[0] * b[2]
+    c[2] = a[0] * b[1] - a[1] * b[0]
+    return c
 
+
+@numba.njit(cache=True, fastmath=True)
+def _matvec3_t(R, v):
+    # Apply R^T; for the orthogonal R built by Rot this is applying R^-1.
+    r = numpy.empty(3)
+    r[0] = R[0, 0] * v[0] + R[1, 0] * v[1] + R[2, 0] * v[2]
+    r[1] = R[0, 1] * v[0] + R[1, 1] * v[1] + R[2, 1] * v[2]
+    r[2] = R[0, 2] * v[0] + R[1, 2] * v[1] + R[2, 2] * v[2]
+    return r
+
+
+@numba.njit(cache=True, fastmath=True)
+def _matvec3(R, v):
+    r = numpy.empty(3)
+    r[0] = R[0, 0] * v[0] + R[0, 1] * v[1] + R[0, 2] * v[2]
+    r[1] = R[1, 0] * v[0] + R[1, 1] * v[1] + R[1, 2] * v[2]
+    r[2] = R[2, 0] * v[0] + R[2, 1] * v[1] + R[2, 2] * v[2]
+    return r
+
+
+@numba.njit(cache=True, fastmath=True)
+def Rot(base, v):
+    # Rodrigues' formula on the rotation vector x = base cross v, with the
+    # Taylor limits at theta == 0: R = cos(theta) I + b x x^T + a [x]_cross.
+    x = _cross3(base, v)
+    theta = numpy.sqrt(x[0] * x[0] + x[1] * x[1] + x[2] * x[2])
+    if theta < 1e-12:
+        a = 1.0
+        b = 0.5
+    else:
+        a = numpy.sin(theta) / theta
+        b = (1.0 - numpy.cos(theta)) / (theta * theta)
+    c = 1.0 - b * theta * theta  # == cos(theta)
+    R = numpy.empty((3, 3))
+    R[0, 0] = c + b * x[0] * x[0]
+    R[0, 1] = b * x[0] * x[1] - a * x[2]
+    R[0, 2] = b * x[0] * x[2] + a * x[1]
+    R[1, 0] = b * x[0] * x[1] + a * x[2]
+    R[1, 1] = c + b * x[1] * x[1]
+    R[1, 2] = b * x[1] * x[2] - a * x[0]
+    R[2, 0] = b * x[0] * x[2] - a * x[1]
+    R[2, 1] = b * x[1] * x[2] + a * x[0]
+    R[2, 2] = c + b * x[2] * x[2]
+    return R
+
+
+@numba.njit(cache=True, fastmath=True)
 def Exp(base, v):
-    return numpy.matmul(Rot(base, v), base)
+    # Closed form on the unit sphere: walk from base along the tangent part
+    # of v. theta == |base cross v| for unit base, so no rotation matrix is
+    # needed at all.
+    p = _cross3(_cross3(base, v), base)
+    theta = numpy.sqrt(p[0] * p[0] + p[1] * p[1] + p[2] * p[2])
+    if theta < 1e-12:
+        return base + p
+    else:
+        return numpy.cos(theta) * base + (numpy.sin(theta) / theta) * p
 
 
+@numba.njit(cache=True, fastmath=True)
 def Log(base, p):
-    v = numpy.cross(numpy.cross(base, p), base)
-    s = numpy.linalg.norm(v, ord=2)
-    if numpy.isclose(s, 0.0):
-        # s == 0 implies v == (0, 0, 0)
-        return numpy.zeros(3)
+    v = _cross3(_cross3(base, p), base)
+    s = numpy.sqrt(v[0] * v[0] + v[1] * v[1] + v[2] * v[2])
+    # arcsin(s)/s has a removable singularity at 0; switch to its Taylor
+    # series 1 + s^2/6 + ... there and always scale v, so small angles take
+    # the same path as everything else.
+    if s < 1e-8:
+        factor = 1.0 + s * s / 6.0
     else:
-        # Need to worry about values near 0/0?
-        return (numpy.arcsin(s) / s) * v
+        factor = numpy.arcsin(s) / s
+    return factor * v
 
 
+@numba.njit(cache=True, fastmath=True)
 def pack_global_state(x, v, a, q, w, u):
+    # Fast pack: trusts the caller that the state is (close enough to) on
+    # the manifold. Use pack_global_state_projected for states handed back
+    # to the outside world.
+    return numpy.concatenate((x, v, a, q, w, u))
+
+
+@numba.njit(cache=True, fastmath=True)
+def pack_global_state_projected(x, v, a, q, w, u):
     # project state onto manifold.
-    q = q / numpy.linalg.norm(q, ord=2)
+    q = q / numpy.sqrt(q[0] * q[0] + q[1] * q[1] + q[2] * q[2])
     w = w - numpy.dot(w, q) * q  # q is unit
     u = u - numpy.dot(u, q) * q
     # pack.
     return numpy.concatenate((x, v, a, q, w, u))
 
 
+@numba.njit(cache=True, fastmath=True)
 def pack_local_state(x, v, a, q, w, u):
     return numpy.concatenate((x, v, a, q, w, u))
 
 
+@numba.njit(cache=True, fastmath=True)
 def unpack_state(s):
     return s[0:3], s[3:6], s[6:9], s[9:12], s[12:15], s[15:18]
 
 
+@numba.njit(cache=True, fastmath=True)
 def evolve_state(s, dt):
     x, v, a, q, w, u = unpack_state(s)
     R = Rot(q, dt * w + 0.5 * dt * dt * u)
-    return pack_global_state(
+    return pack_global_state_projected(
         x + dt * v + 0.5 * dt * dt * a,
         v + dt * a,
         a,
-        numpy.matmul(R, q),
-        numpy.matmul(R, w + dt * u),
-        numpy.matmul(R, u),
+        _matvec3(R, q),
+        _matvec3(R, w + dt * u),
+        _matvec3(R, u),
     )
 
 
+@numba.njit(cache=True, fastmath=True)
 def local_transition_cov(s, Q):
+    # The projection matrix is the identity except for (I - q q^T) on the
+    # w and u blocks, so conjugating Q only touches rows and columns 12:18.
+    # Applying the 3x3 projector to those strips is exact and much cheaper
+    # than the full 18x18 triple product.
+    _, _, _, q, _, _ = unpack_state(s)
+    B = numpy.empty((3, 3))
+    for i in range(3):
+        for j in range(3):
+            B[i, j] = (1.0 if i == j else 0.0) - q[i] * q[j]
+    C = Q.copy()
+    C[12:15, :] = B @ numpy.ascontiguousarray(Q[12:15, :])
+    C[15:18, :] = B @ numpy.ascontiguousarray(Q[15:18, :])
+    # B is symmetric, so right-multiplying by B is right-multiplying by B.T.
+    C[:, 12:15] = numpy.ascontiguousarray(C[:, 12:15]) @ B
+    C[:, 15:18] = numpy.ascontiguousarray(C[:, 15:18]) @ B
+    return C
+
+
+@numba.njit(cache=True, fastmath=True)
+def local_transition_cov_diag(s, Q_diag):
+    # Specialization of local_transition_cov for a diagonal Q, given as its
+    # 18 diagonal entries. Only the two projected 3x3 blocks are dense in
+    # the result; everything else stays diagonal.
     _, _, _, q, _, _ = unpack_state(s)
-    P = numpy.eye(18)
-    P[12:15, 12:15] -= numpy.outer(q, q)
-    P[15:18, 15:18] -= numpy.outer(q, q)
-    return P @ Q @ P.T
+    B = numpy.empty((3, 3))
+    for i in range(3):
+        for j in range(3):
+            B[i, j] = (1.0 if i == j else 0.0) - q[i] * q[j]
+    C = numpy.zeros((18, 18))
+    for i in range(12):
+        C[i, i] = Q_diag[i]
+    for b in (12, 15):
+        for i in range(3):
+            for j in range(3):
+                acc = 0.0
+                for k in range(3):
+                    acc += B[i, k] * Q_diag[b + k] * B[j, k]
+                C[b + i, b + j] = acc
+    return C
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -130,6 +264,7 @@ def local_transition_cov(s, Q):
 # of the sphere at q, using w as the origin.
 
 
+@numba.njit(cache=True, fastmath=True)
 def global_to_local(base, g):
     cx, cv, ca, cq, cw, cu = unpack_state(base)
     gx, gv, ga, gq, gw, gu = unpack_state(g)
@@ -138,22 +273,192 @@ def global_to_local(base, g):
     la = ga - ca
     lq = Log(cq, gq)
     R = Rot(cq, lq)
-    lw = numpy.linalg.solve(R, gw) - cw
-    lu = numpy.linalg.solve(R, gu) - cu
+    lw = _matvec3_t(R, gw) - cw
+    lu = _matvec3_t(R, gu) - cu
     return pack_local_state(lx, lv, la, lq, lw, lu)
 
 
+@numba.njit(cache=True, fastmath=True)
 def local_to_global(base, l):
     cx, cv, ca, cq, cw, cu = unpack_state(base)
     lx, lv, la, lq, lw, lu = unpack_state(l)
     gx = cx + lx
     gv = cv + lv
     ga = ca + la
-    gq = Exp(cq, lq)
+    # One Rodrigues evaluation serves both the point and the w/u transport:
+    # Exp(cq, lq) == Rot(cq, lq) @ cq.
     R = Rot(cq, lq)
-    gw = numpy.matmul(R, cw + lw)
-    gu = numpy.matmul(R, cu + lu)
-    return pack_global_state(gx, gv, ga, gq, gw, gu)
+    gq = _matvec3(R, cq)
+    gw = _matvec3(R, cw + lw)
+    gu = _matvec3(R, cu + lu)
+    return pack_global_state_projected(gx, gv, ga, gq, gw, gu)
+
+
+def transport_cov(base, v, P):
+    """Conjugate a local covariance by the tangent transport to Exp(base, v).
+
+    To first order the frame change from the tangent space at `base` to
+    the one at Exp(base, v) is the rotation carrying the direction
+    component along, applied to the q, w, and u blocks; the Euclidean
+    blocks are unaffected. This computes T @ P @ T.T for that
+    block-diagonal transport T.
+    """
+    _, _, _, q, _, _ = unpack_state(base)
+    R = Rot(q, v)
+    C = P.copy()
+    for i in (9, 12, 15):
+        C[i:i + 3, :] = R @ C[i:i + 3, :]
+    for i in (9, 12, 15):
+        C[:, i:i + 3] = C[:, i:i + 3] @ R.T
+    return C
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# Batched variants treat the columns of an (18, N) matrix as N independent
+# states and mirror the scalar functions above, keeping the arithmetic in
+# whole-bank ufunc calls rather than a Python loop over columns.
+
+
+@dataclasses.dataclass
+class SigmaBank:
+    """Named views into a bank of states.
+
+    The bank is stored as a single (18, N) array (or a single 18-vector);
+    the six attributes are zero-copy row views. In C order each 3-row block
+    is contiguous, so block-wise vectorized operations touch contiguous
+    memory while the full matrix stays available for covariance algebra.
+    """
+
+    data: numpy.ndarray
+
+    @property
+    def x(self):
+        return self.data[0:3]
+
+    @property
+    def v(self):
+        return self.data[3:6]
+
+    @property
+    def a(self):
+        return self.data[6:9]
+
+    @property
+    def q(self):
+        return self.data[9:12]
+
+    @property
+    def w(self):
+        return self.data[12:15]
+
+    @property
+    def u(self):
+        return self.data[15:18]
+
+
+def _cross_batch(a, b):
+    # Column-wise cross product as three multiply-subtract lines. The
+    # operands may be (3,) or (3, N); broadcasting covers both.
+    return numpy.stack((
+        a[1] * b[2] - a[2] * b[1],
+        a[2] * b[0] - a[0] * b[2],
+        a[0] * b[1] - a[1] * b[0],
+    ))
+
+
+def rot_from_rotvec_batch(X):
+    """Rotation matrices (3, 3, N) from the rotation vectors in X (3, N)."""
+    theta = numpy.linalg.norm(X, axis=0)
+    # Guard the removable singularity at theta == 0 with the Taylor limits.
+    safe = numpy.where(theta > 0.0, theta, 1.0)
+    a = numpy.where(theta > 0.0, numpy.sin(safe) / safe, 1.0)
+    b = numpy.where(theta > 0.0, (1.0 - numpy.cos(safe)) / (safe * safe), 0.5)
+
+    # Rodrigues: R = cos(theta) I + b x x^T + a [x]_cross
+    x0, x1, x2 = X
+    R = b * X[:, numpy.newaxis, :] * X[numpy.newaxis, :, :]
+    c = 1.0 - b * theta * theta  # == cos(theta)
+    R[0, 0] += c
+    R[1, 1] += c
+    R[2, 2] += c
+    R[0, 1] -= a * x2
+    R[1, 0] += a * x2
+    R[0, 2] += a * x1
+    R[2, 0] -= a * x1
+    R[1, 2] -= a * x0
+    R[2, 1] += a * x0
+    return R
+
+
+def Log_batch(base, P):
+    v = _cross_batch(_cross_batch(base, P), base)
+    s = numpy.linalg.norm(v, axis=0)
+    # Same Taylor-safe selection as the scalar Log, in vectorized form.
+    small = s < 1e-8
+    safe = numpy.where(small, 1.0, s)
+    factor = numpy.where(small, 1.0 + s * s / 6.0, numpy.arcsin(safe) / safe)
+    return factor * v
+
+
+def pack_global_state_batch(x, v, a, q, w, u):
+    # Fast pack; see pack_global_state.
+    return numpy.concatenate((x, v, a, q, w, u))
+
+
+def pack_global_state_batch_projected(x, v, a, q, w, u):
+    # project each column onto the manifold.
+    q = q / numpy.linalg.norm(q, axis=0)
+    w = w - numpy.sum(w * q, axis=0) * q
+    u = u - numpy.sum(u * q, axis=0) * q
+    # pack.
+    return numpy.concatenate((x, v, a, q, w, u))
+
+
+def evolve_state_batch(S, dt):
+    b = SigmaBank(S)
+    X = _cross_batch(b.q, dt * b.w + 0.5 * dt * dt * b.u)
+    R = rot_from_rotvec_batch(X)
+    # Project once here, at the end of a propagation: the intermediate
+    # banks only pass through orthogonal rotations, which commute with the
+    # projection, so projecting at every pack was redundant.
+    return pack_global_state_batch_projected(
+        b.x + dt * b.v + 0.5 * dt * dt * b.a,
+        b.v + dt * b.a,
+        b.a,
+        numpy.einsum("ijk,jk->ik", R, b.q),
+        numpy.einsum("ijk,jk->ik", R, b.w + dt * b.u),
+        numpy.einsum("ijk,jk->ik", R, b.u),
+    )
+
+
+def global_to_local_batch(base, G):
+    c = SigmaBank(base)
+    g = SigmaBank(G)
+    lx = g.x - c.x[:, numpy.newaxis]
+    lv = g.v - c.v[:, numpy.newaxis]
+    la = g.a - c.a[:, numpy.newaxis]
+    lq = Log_batch(c.q, g.q)
+    R = rot_from_rotvec_batch(_cross_batch(c.q, lq))
+    # R is orthogonal, so applying its inverse is applying its transpose.
+    lw = numpy.einsum("jik,jk->ik", R, g.w) - c.w[:, numpy.newaxis]
+    lu = numpy.einsum("jik,jk->ik", R, g.u) - c.u[:, numpy.newaxis]
+    return numpy.concatenate((lx, lv, la, lq, lw, lu))
+
+
+def local_to_global_batch(base, L):
+    c = SigmaBank(base)
+    l = SigmaBank(L)
+    gx = c.x[:, numpy.newaxis] + l.x
+    gv = c.v[:, numpy.newaxis] + l.v
+    ga = c.a[:, numpy.newaxis] + l.a
+    R = rot_from_rotvec_batch(_cross_batch(c.q, l.q))
+    gq = numpy.einsum("ijk,j->ik", R, c.q)
+    gw = numpy.einsum("ijk,jk->ik", R, c.w[:, numpy.newaxis] + l.w)
+    gu = numpy.einsum("ijk,jk->ik", R, c.u[:, numpy.newaxis] + l.u)
+    # No projection: gq is a rotation of the unit cq, and downstream
+    # consumers either re-project (evolve_state_batch) or only use
+    # rotation-invariant combinations.
+    return pack_global_state_batch(gx, gv, ga, gq, gw, gu)
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -161,6 +466,7 @@ def local_to_global(base, l):
 # coil positions. They have 3+3 = 6 parameters.
 
 
+@numba.njit(cache=True, fastmath=True)
 def pack_observation(a, b):
     return numpy.concatenate((a, b))
 
@@ -169,11 +475,22 @@ def unpack_observation(o):
     return o[0:3], o[3:6]
 
 
+@numba.njit(cache=True, fastmath=True)
 def observe_state(s, coil_offset):
     x, _, _, q, _, _ = unpack_state(s)
     return pack_observation(x + coil_offset * q, x - coil_offset * q)
 
 
+def observe_state_batch(S, coil_offset, out=None):
+    b = SigmaBank(S)
+    if out is None:
+        out = numpy.empty((6, S.shape[1]))
+    numpy.multiply(coil_offset, b.q, out=out[0:3])
+    numpy.subtract(b.x, out[0:3], out=out[3:6])
+    out[0:3] += b.x
+    return out
+
+
 def tip_from_state(s, tip_offset):
     x, _, _, q, _, _ = unpack_state(s)
     return x + tip_offset * q
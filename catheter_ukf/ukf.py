@@ -23,6 +23,12 @@ class UKF(object):
         self._ukf = riemannian_ukf.RiemannianUKF(s, u)
         self.Q = self._create_transition_cov(s.tip_offset)
         self.R = self._create_measurement_cov()
+        # Q is diagonal by construction; its 18 diagonal entries are all the
+        # predict phase needs.
+        self._Q_diag = numpy.diag(self.Q)
+        # R is constant, so its Cholesky factor (needed for the square-root
+        # innovation update) can be taken once here rather than every step.
+        self._R_chol = numpy.linalg.cholesky(self.R)
 
     def predict(self, x, P, dt):
         """Perform the predict phase of the unscented Kalman filter.
@@ -36,7 +42,7 @@ class UKF(object):
             x: The predicted state estimate.
             P: The predicted error covariance.
         """
-        return self._ukf.predict(x, P, self.Q, dt)
+        return self._ukf.predict(x, P, self._Q_diag, dt)
 
     def update(self, x, P, z):
         """Perform the update phase of the unscented Kalman filter.
@@ -50,7 +56,7 @@ class UKF(object):
             x: The a-posteriori state estimate.
             P: The a-posteriori error covariance.
         """
-        return self._ukf.update(x, P, self.R, z)
+        return self._ukf.update(x, P, self.R, z, R_chol=self._R_chol)
 
     def filter(self, x, P, z, dt):
         """Perform a combination predict/update step using this unscented
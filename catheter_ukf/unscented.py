@@ -1,7 +1,6 @@
 """This module implements the `unscented transform` required for the UKF."""
 
 import numpy
-import scipy.linalg
 
 
 class Unscented(object):
@@ -13,82 +12,195 @@ class Unscented(object):
 
     def __init__(self, h):
         self.h = h
+        # The weights depend only on (M, h); for a given filter M is fixed,
+        # so build each size's weight vector (and its square roots) once.
+        self._weights_cache = {}
 
-    def sigmas_from_stats(self, x, P):
+    def weights(self, M):
+        """The cached sigma weights and their square roots for a size-M state.
+
+        Args:
+            M: The dimension of the state.
+
+        Returns:
+            weights: The sigma-point weights.
+            weights_sqrt: Their elementwise square roots.
+        """
+        try:
+            return self._weights_cache[M]
+        except KeyError:
+            weights = _weights(M, self.h)
+            cached = (weights, numpy.sqrt(weights))
+            self._weights_cache[M] = cached
+            return cached
+
+    def sigmas_from_stats(self, x, P, out=None):
         """Compute sigma points and weights from the given parameters.
 
         Args:
             x: The mean of the sigma points.
             P: The covariance of the sigma points.
-        
+            out: Optional preallocated (M, 2M + 1) array for the sigmas.
+
+        Returns:
+            sigmas: The calculated sigma points.
+            weights: The calculated weights.
+        """
+        sigmas = _sigma_points(x, P, self.h, out)
+        return sigmas, self.weights(P.shape[0])[0]
+
+    def sigmas_from_stats_zero(self, P, out=None):
+        """Compute sigma points and weights for a zero mean.
+
+        Args:
+            P: The covariance of the sigma points.
+            out: Optional preallocated (M, 2M + 1) array for the sigmas.
+
         Returns:
             sigmas: The calculated sigma points.
             weights: The calculated weights.
         """
-        return sigmas_from_stats(x, P, self.h)
+        sigmas = _sigma_points_zero(P, self.h, out)
+        return sigmas, self.weights(P.shape[0])[0]
 
-    def stats_from_sigmas(self, sigmas, weights):
+    def stats_from_sigmas(self, sigmas, weights, mean_is_zero=False):
         """Compute the mean and covariance of the given sigma points.
 
         Args:
             sigmas: The sigma points.
             weights: The weights.
-        
+            mean_is_zero: If True, skip computing the mean (known zero).
+
         Returns:
             x: The weighted mean of the sigma points.
             P: The weighted covariance of the sigma points.
+            D: The centered sigma points (sigmas with x subtracted).
         """
-        return stats_from_sigmas(sigmas, weights)
+        cached = self._weights_cache.get(sigmas.shape[0])
+        weights_sqrt = None
+        if cached is not None and weights is cached[0]:
+            weights_sqrt = cached[1]
+        return stats_from_sigmas(sigmas, weights, mean_is_zero, weights_sqrt)
 
 
-def sigmas_from_stats(x, P, h):
+def sigmas_from_stats(x, P, h, out=None):
     """Compute sigma points and weights from the given parameters.
-    
+
     Compute a set of sigma points and weights representing the given mean
     and covariance.
-    
+
     Args:
         x: The mean of the sigma points.
         P: The covariance of the sigma points.
         h: The `spread` of the sigma points. Controls distance between sigmas.
-    
+        out: Optional preallocated (M, 2M + 1) array for the sigmas.
+
+    Returns:
+        sigmas: The calculated sigma points.
+        weights: The calculated weights.
+    """
+
+    return _sigma_points(x, P, h, out), _weights(P.shape[0], h)
+
+
+def sigmas_from_stats_zero(P, h, out=None):
+    """Compute sigma points and weights for a zero mean.
+
+    The local base point of the Riemannian filter is always the origin, so
+    the x broadcast of `sigmas_from_stats` can be skipped entirely.
+
+    Args:
+        P: The covariance of the sigma points.
+        h: The `spread` of the sigma points. Controls distance between sigmas.
+        out: Optional preallocated (M, 2M + 1) array for the sigmas.
+
     Returns:
         sigmas: The calculated sigma points.
         weights: The calculated weights.
     """
 
+    return _sigma_points_zero(P, h, out), _weights(P.shape[0], h)
+
+
+def _sigma_points(x, P, h, out=None):
+    M = P.shape[0]
+    sqrt_Q = _sqrt_factor(P, h)
+
+    # Calculate sigmas, laid out as [x, x + sqrt_Q, x - sqrt_Q]. Two
+    # contiguous block writes instead of broadcasting x into every column
+    # and updating the odd/even columns with strided adds.
+    sigmas = numpy.empty((M, 2 * M + 1)) if out is None else out
+    sigmas[:, 0] = x
+    sigmas[:, 1:M + 1] = x[:, numpy.newaxis] + sqrt_Q
+    sigmas[:, M + 1:] = x[:, numpy.newaxis] - sqrt_Q
+    return sigmas
+
+
+def _sigma_points_zero(P, h, out=None):
+    M = P.shape[0]
+    sqrt_Q = _sqrt_factor(P, h)
+
+    sigmas = numpy.empty((M, 2 * M + 1)) if out is None else out
+    sigmas[:, 0] = 0.0
+    sigmas[:, 1:M + 1] = sqrt_Q
+    numpy.negative(sqrt_Q, out=sigmas[:, M + 1:])
+    return sigmas
+
+
+def _sqrt_factor(P, h):
     # Calculate required sqrt... sqrt(Q) where Q = (M + h) * P
+    # A Cholesky factor L with L @ L.T == Q is a valid (and cheap) choice.
+    # Factor P itself and scale the (triangular) factor, rather than
+    # scaling the full matrix before factoring it.
     M = P.shape[0]
-    sqrt_Q = scipy.linalg.sqrtm((M + h) * P)
-    sqrt_Q = numpy.real(sqrt_Q)  # Should include a sanity check somewhere?
+    scale = numpy.sqrt(M + h)
+    try:
+        return scale * numpy.linalg.cholesky(P)
+    except numpy.linalg.LinAlgError:
+        # P may have drifted slightly indefinite; symmetrize and add jitter.
+        P = 0.5 * (P + P.T) + 1e-12 * numpy.eye(M)
+        return scale * numpy.linalg.cholesky(P)
 
-    # Calculate sigmas
-    sigmas = numpy.repeat(numpy.reshape(x, (len(x), 1)), (2 * M) + 1, axis=1)
-    sigmas[:, 1::2] += sqrt_Q
-    sigmas[:, 2::2] -= sqrt_Q
 
-    # Calculate weights
+def _weights(M, h):
     weights = numpy.repeat(1.0 / (2 * (h + M)), 2 * M + 1)
     weights[0] = h / (h + M)
-
-    return sigmas, weights
+    return weights
 
 
-def stats_from_sigmas(sigmas, weights):
+def stats_from_sigmas(sigmas, weights, mean_is_zero=False, weights_sqrt=None):
     """Compute the mean and covariance of the given sigma points.
-    
+
     Compute the mean and covariance represented by a set of sigma points
     and weights.
-    
+
     Args:
         sigmas: The sigma points.
         weights: The weights.
-    
+        mean_is_zero: If True, skip computing the mean (known zero).
+        weights_sqrt: Optional precomputed square roots of the weights.
+
     Returns:
         x: The weighted mean of the sigma points.
         P: The weighted covariance of the sigma points.
+        D: The centered sigma points (sigmas with x subtracted).
     """
 
-    x = numpy.average(sigmas, weights=weights, axis=1)
-    P = numpy.cov(sigmas, aweights=weights, bias=1)
-    return x, P
+    # The weights sum to one, so the mean is a plain matrix-vector product
+    # and no normalization pass (as numpy.cov would do) is needed. The
+    # centered sigmas are returned so callers can reuse them for
+    # cross-covariances instead of centering again.
+    if mean_is_zero:
+        x = numpy.zeros(sigmas.shape[0])
+        D = sigmas
+    else:
+        x = sigmas @ weights
+        D = sigmas - x[:, numpy.newaxis]
+    # The weights are nonnegative, so the covariance is the Gram matrix of
+    # the sqrt-weighted centered sigmas: one scaled copy instead of two,
+    # and symmetric up to matmul rounding.
+    if weights_sqrt is None:
+        weights_sqrt = numpy.sqrt(weights)
+    Dw = D * weights_sqrt
+    P = Dw @ Dw.T
+    return x, P, D
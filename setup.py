@@ -7,7 +7,6 @@ setup(
     install_requires=[
         "numba",
         "numpy",
-        "numpy-quaternion",
         "scipy",
     ],
 )